@@ -1,18 +1,34 @@
 import streamlit as st
-from langchain.document_loaders import JSONLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import chromadb
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain.vectorstores import Chroma
 from langchain.prompts import PromptTemplate
+from langchain.schema import Document
 from langchain.chains import RetrievalQA
-from reddit_data_download import get_reddit_data
+from semantic_text_splitter import TextSplitter
+from blake3 import blake3
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+from reddit_data_download import get_reddit_data, run_coroutine
 import os
 from dotenv import load_dotenv
 import asyncio
+import atexit
+import contextlib
+import itertools
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import time
-import json
-import hashlib
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Use uvloop for the app's event loops when it's available (not on Windows)
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 
 load_dotenv()
 
@@ -25,54 +41,36 @@ st.set_page_config(
 )
 
 # --- Custom CSS for Premium UI ---
-st.markdown("""
-    <style>
-    .main {
-        background-color: #0e1117;
-    }
-    h1 {
-        font-family: 'Inter', sans-serif;
-        background: -webkit-linear-gradient(45deg, #4285F4, #9B72CB);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        font-weight: 800;
-    }
-    h2, h3 {
-        font-family: 'Inter', sans-serif;
-        color: #E0E0E0;
-    }
-    .stButton>button {
-        background: linear-gradient(90deg, #4285F4 0%, #9B72CB 100%);
-        color: white;
-        border: none;
-        padding: 0.5rem 1rem;
-        border-radius: 8px;
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-    .stButton>button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(66, 133, 244, 0.3);
-    }
-    .metric-card {
-        background-color: #262730;
-        padding: 1rem;
-        border-radius: 8px;
-        border: 1px solid #464855;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+STYLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "style.css")
+
+
+@st.cache_data
+def load_css():
+    """Reads the app stylesheet once and wraps it in a <style> tag."""
+    with open(STYLE_FILE) as f:
+        return f"<style>\n{f.read()}</style>"
+
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # --- Configure Logging ---
 LOG_FILE = "streamlit_app.log"
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-file_handler = logging.FileHandler(LOG_FILE)
-file_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+logger.setLevel(logging.INFO)
+
+# Streamlit re-executes this script on every rerun; only attach the handlers once.
+# Records go through a queue and a background listener writes them to the file.
+if not logger.handlers:
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, file_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # --- Constants ---
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -80,78 +78,288 @@ DATA_DIR = "data"
 CHROMA_DB_DIR = "chroma_db"
 DEFAULT_FLAIRS = ["Android 15 QPR1 Beta 1", "Android 15 QPR1 Beta 2", "Android 15 QPR1 Beta 3", "Android 16 DP1", "Android 16 DP2", "Android 16 Beta 1", "Android 16 Beta 2"]
 TIME_FILTERS = ["hour", "day", "week", "month", "year", "all"]
+EMBED_BATCH_SIZE = 100
+# Max number of embedding batches in flight at once (keeps bursts under Gemini's rate limit)
+MAX_CONCURRENT_EMBEDDINGS = 4
+# Attempts per embedding batch when Gemini rate-limits (429) or is unavailable (503)
+EMBED_MAX_ATTEMPTS = 5
+RETRYABLE_EMBEDDING_ERRORS = (TooManyRequests, ServiceUnavailable)
+# Max number of fetched posts waiting to be chunked and embedded
+POST_QUEUE_SIZE = 32
+# Put on the post queue instead of the None sentinel when the Reddit fetch fails
+FETCH_FAILED = object()
+# Gemini embeddings are truncated to this many dimensions (down from 3072) to shrink the index
+EMBEDDING_DIMENSIONS = 768
+# HNSW index settings applied when a collection is first created
+CHROMA_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 64,
+}
+# Collection metadata key holding a hash of the indexed chunk texts
+CONTENT_FINGERPRINT_KEY = "content_fingerprint"
 
 # Ensure directories exist
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
 
-def process_reddit_data(reddit_data, identifier):
-    """Processes the fetched Reddit data and creates the vector store."""
+class CompactGoogleEmbeddings(GoogleGenerativeAIEmbeddings):
+    """Gemini embeddings requested at EMBEDDING_DIMENSIONS for both documents and queries."""
+
+    def embed_documents(self, texts, **kwargs):
+        kwargs.setdefault("output_dimensionality", EMBEDDING_DIMENSIONS)
+        return super().embed_documents(texts, **kwargs)
+
+    def embed_query(self, text, **kwargs):
+        kwargs.setdefault("output_dimensionality", EMBEDDING_DIMENSIONS)
+        return super().embed_query(text, **kwargs)
+
+
+@st.cache_resource
+def get_embeddings():
+    """Returns the shared Gemini embeddings client (reused across reruns)."""
+    return CompactGoogleEmbeddings(model="models/gemini-embedding-001", google_api_key=GOOGLE_API_KEY)
+
+
+@st.cache_resource
+def get_text_splitter():
+    """Returns the shared Rust-backed text splitter (reused across reruns)."""
+    return TextSplitter(capacity=1000, overlap=200)
+
+
+@st.cache_resource
+def get_chroma_client():
+    """Returns the shared persistent Chroma client (opened once, reused across reruns)."""
+    return chromadb.PersistentClient(path=CHROMA_DB_DIR)
+
+
+def _open_collection(client, collection_name, embeddings):
+    """Opens (or creates) a persisted Chroma collection with the tuned HNSW settings."""
+    return Chroma(
+        client=client,
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        collection_metadata=CHROMA_COLLECTION_METADATA,
+    )
+
+
+def _collection_name(data_type, identifier, time_filter):
+    """Derives the Chroma collection name for a data source."""
+    # The source type, time filter and embedding size are part of the key so a flair and a
+    # keyword search (or two time filters) never share a collection, nor do different dimensions
+    key = f"{data_type}:{identifier}:{time_filter}:{EMBEDDING_DIMENSIONS}"
+    hex_dig = blake3(key.encode('utf-8')).hexdigest()
+    return f"reddit_{hex_dig[:56]}"
+
+
+def _collection_metadata(fingerprint):
+    """Collection metadata recording the fingerprint of the indexed chunks."""
+    # Chroma refuses to change hnsw:space after creation; the index keeps its own HNSW settings
+    metadata = {key: value for key, value in CHROMA_COLLECTION_METADATA.items() if key != "hnsw:space"}
+    metadata[CONTENT_FINGERPRINT_KEY] = fingerprint
+    return metadata
+
+
+def _fingerprinted(documents, digests):
+    """Passes documents through while recording a digest of each chunk's text."""
+    for doc in documents:
+        digests.append(blake3(doc.page_content.encode('utf-8')).digest())
+        yield doc
+
+
+def _fingerprint(digests):
+    """Combines chunk digests into the content fingerprint."""
+    # Sorted so the fingerprint doesn't depend on the order the concurrent fetches finished in
+    return blake3(b"".join(sorted(digests))).hexdigest()
+
+
+def _chunk_posts(post_queue, text_splitter):
+    """Yields chunked documents for posts taken off the queue until the None sentinel."""
+    while (post := post_queue.get()) is not None:
+        if post is FETCH_FAILED:
+            raise RuntimeError("Reddit fetch failed part-way; discarding the partial data")
+        # Build documents straight from the fetched posts (no temp file / jq round-trip)
+        content = f"{post['title']}\n{post['text']}\n" + "\n".join(post['comments'])
+        for chunk in text_splitter.chunks(content):
+            yield Document(page_content=chunk, metadata={"title": post['title']})
+
+
+def process_reddit_data_streaming(post_queue, client, collection_name, embeddings, text_splitter, force_refresh=False):
+    """
+    Chunks posts as they arrive on the queue and embeds them in batches while
+    the Reddit fetch is still running, then stores them in the vector store.
+    Runs in a worker thread, so errors are raised to the caller and Streamlit
+    caches are left alone. Returns the vector store (or None if no posts
+    arrived) and whether an existing collection was rebuilt.
+    """
+    documents = _chunk_posts(post_queue, text_splitter)
+    first = next(documents, None)
+    if first is None:
+        return None, False
+    digests = []
+    documents = _fingerprinted(itertools.chain([first], documents), digests)
+
+    vectordb = _open_collection(client, collection_name, embeddings)
+
+    # --- Reuse the existing collection if it already holds exactly these chunks ---
+    existing_count = vectordb._collection.count()
+    if existing_count and not force_refresh:
+        # Every chunk is needed to compute the fingerprint before deciding
+        documents = list(documents)
+        if (vectordb._collection.metadata or {}).get(CONTENT_FINGERPRINT_KEY) == _fingerprint(digests):
+            logger.info(f"Reusing collection {collection_name} ({existing_count} chunks)")
+            return vectordb, False
+    rebuilt = bool(existing_count)
+    # The old chunks stay in place until every new one is stored, so a failed rebuild
+    # (fetch error, exhausted retries) leaves the previous index and its fingerprint intact.
+    # Rebuilding in the same collection keeps QA chains other sessions built on it valid.
+    old_ids = vectordb._collection.get(include=[])["ids"] if rebuilt else []
+    added_ids = []
     try:
-        temp_file_path = os.path.join(DATA_DIR, f"temp_{hashlib.sha256(identifier.encode('utf-8')).hexdigest()}.json")
-        with open(temp_file_path, "w") as f:
-            json.dump(reddit_data, f)
-
-        loader = JSONLoader(file_path=temp_file_path, jq_schema='.', text_content=False)
-        data = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        documents = text_splitter.split_documents(data)
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001", google_api_key=GOOGLE_API_KEY)
-
-        # --- Use Hashing for Collection Name ---
-        hash_object = hashlib.sha256(identifier.encode('utf-8'))
-        hex_dig = hash_object.hexdigest()
-        collection_name = f"reddit_{hex_dig[:56]}"
-
-        vectordb = Chroma.from_documents(
-            documents,
-            embeddings,
-            persist_directory=CHROMA_DB_DIR,
-            collection_name=collection_name,
-        )
-        vectordb.persist()
-        return vectordb
+        _embed_and_store(vectordb, embeddings, documents, added_ids)
+    except Exception:
+        _delete_ids(vectordb, added_ids)
+        raise
+    _delete_ids(vectordb, old_ids)
+    # Only a fully indexed collection gets its fingerprint, so partial ones are never reused
+    vectordb._collection.modify(metadata=_collection_metadata(_fingerprint(digests)))
+    return vectordb, rebuilt
 
-    except Exception as e:
-        logger.exception(f"Error in process_reddit_data: {e}")
-        st.error(f"An error occurred during data processing: {e}")
-        return None
 
+def _delete_ids(vectordb, ids):
+    """Deletes chunks from a collection in batches Chroma accepts."""
+    batch_size = vectordb._client.get_max_batch_size()
+    for i in range(0, len(ids), batch_size):
+        vectordb._collection.delete(ids=ids[i:i + batch_size])
 
-def create_qa_chain(vectordb):
-    """Creates a RetrievalQA chain."""
-    if vectordb is None:
-        return None
 
-    try:
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=GOOGLE_API_KEY,
-            temperature=0.2,
-            max_retries=6,
-        )
-        template = """You are a helpful Android Feedback Assistant. Use the following user comments to answer the question. 
+def _is_retryable_embedding_error(error):
+    """True for Gemini rate-limit/unavailable errors (langchain_google_genai wraps them)."""
+    return isinstance(error, RETRYABLE_EMBEDDING_ERRORS) or isinstance(error.__cause__, RETRYABLE_EMBEDDING_ERRORS)
+
+
+@retry(
+    retry=retry_if_exception(_is_retryable_embedding_error),
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    stop=stop_after_attempt(EMBED_MAX_ATTEMPTS),
+    reraise=True,
+)
+def _embed_batch(embeddings, texts):
+    """Embeds one batch, backing off and retrying on 429s and 503s."""
+    return embeddings.embed_documents(texts)
+
+
+def _embed_and_store(vectordb, embeddings, documents, added_ids):
+    """
+    Embeds documents in batches as they arrive and stores each batch once it's
+    embedded, recording the ids it stored in `added_ids`.
+    """
+    in_flight = {}
+
+    def store(futures):
+        for future in futures:
+            batch = in_flight.pop(future)
+            ids = [str(uuid.uuid4()) for _ in batch]
+            vectordb._collection.add(
+                ids=ids,
+                embeddings=future.result(),
+                documents=[doc.page_content for doc in batch],
+                metadatas=[doc.metadata for doc in batch],
+            )
+            added_ids.extend(ids)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_EMBEDDINGS) as pool:
+        def submit(batch):
+            in_flight[pool.submit(_embed_batch, embeddings, [doc.page_content for doc in batch])] = batch
+            store([future for future in in_flight if future.done()])
+            # Back-pressure: stop chunking until a slot frees up, so only a few batches are held in memory
+            if len(in_flight) >= MAX_CONCURRENT_EMBEDDINGS:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                store(done)
+
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == EMBED_BATCH_SIZE:
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
+        store(list(in_flight))
+
+
+@st.cache_resource
+def _build_qa_chain(collection_name, _vectordb):
+    """Builds the RetrievalQA chain for a collection (cached per collection name)."""
+    model = ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0.2,
+        max_retries=6,
+    )
+    template = """You are a helpful Android Feedback Assistant. Use the following user comments to answer the question. 
 If the answer is not in the context, state that clearly.
 Context provided:
 {context}
 
 Question: {question}
 Answer:"""
-        QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
+    QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
 
-        qa_chain = RetrievalQA.from_chain_type(
-            model,
-            retriever=vectordb.as_retriever(search_kwargs={"k": 5}),
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT},
-        )
-        return qa_chain
+    return RetrievalQA.from_chain_type(
+        model,
+        # MMR: fetch 30 candidates and keep the 5 most diverse, so near-duplicate chunks don't waste prompt tokens
+        retriever=_vectordb.as_retriever(
+            search_type="mmr",
+            search_kwargs={"k": 5, "fetch_k": 30, "lambda_mult": 0.5},
+        ),
+        return_source_documents=True,
+        chain_type_kwargs={"prompt": QA_CHAIN_PROMPT},
+    )
+
+
+def create_qa_chain(vectordb):
+    """Creates a RetrievalQA chain."""
+    if vectordb is None:
+        return None
+
+    try:
+        return _build_qa_chain(vectordb._collection.name, vectordb)
     except Exception as e:
         logger.exception(f"Error in create_qa_chain: {e}")
         st.error(f"Failed to create QA chain: {e}")
         return None
 
+def _put_post(post_queue, item, worker):
+    """Puts an item on the bounded post queue; returns False if the worker has stopped consuming."""
+    while True:
+        try:
+            post_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            if worker.done():
+                return False
+
+
+async def _feed_posts(post_queue, worker, data_type, identifier, time_filter):
+    """Pushes posts onto the queue as they are fetched and returns how many there were."""
+    post_count = 0
+    try:
+        async with contextlib.aclosing(get_reddit_data(data_type, identifier, time_filter, DATA_DIR)) as posts:
+            async for post in posts:
+                # Blocking put runs off the event loop so a full queue only holds back this fetch
+                if not await asyncio.to_thread(_put_post, post_queue, post, worker):
+                    break
+                post_count += 1
+    except BaseException:
+        # Tell the worker to discard what it has indexed so far
+        await asyncio.to_thread(_put_post, post_queue, FETCH_FAILED, worker)
+        raise
+    await asyncio.to_thread(_put_post, post_queue, None, worker)
+    return post_count
+
 # --- Session State Initialization ---
 if "qa_chain" not in st.session_state:
     st.session_state.qa_chain = None
@@ -193,17 +401,47 @@ with st.sidebar:
         time_filter = st.selectbox("Time Filter:", options=TIME_FILTERS)
         data_type = "keywords"
 
+    force_refresh = st.checkbox("Force refresh embeddings", value=False)
+
     st.markdown("---")
     
     # Load Data Button
     if st.button("🔄 Load & Process Data", use_container_width=True):
         if identifier:
-             with st.spinner("Fetching discussions from Reddit..."):
-                reddit_data = asyncio.run(get_reddit_data(data_type, identifier, time_filter, DATA_DIR))
-                if reddit_data:
-                    st.success(f"Fetched {len(reddit_data)} threads.")
-                    with st.spinner("Embedding data into Vector Store..."):
-                        vectordb = process_reddit_data(reddit_data, identifier)
+             with st.spinner("Fetching discussions from Reddit and embedding them into the Vector Store..."):
+                post_queue = queue.Queue(maxsize=POST_QUEUE_SIZE)
+                collection_name = _collection_name(data_type, identifier, time_filter)
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    future = executor.submit(
+                        process_reddit_data_streaming,
+                        post_queue,
+                        get_chroma_client(),
+                        collection_name,
+                        get_embeddings(),
+                        get_text_splitter(),
+                        force_refresh,
+                    )
+                    fetch_error = None
+                    try:
+                        post_count = run_coroutine(_feed_posts(post_queue, future, data_type, identifier, time_filter))
+                    except Exception as e:
+                        fetch_error = e
+                    try:
+                        vectordb, rebuilt = future.result()
+                    except Exception as e:
+                        vectordb, rebuilt = None, False
+                        # A failed fetch also stops the worker; only report worker errors of its own
+                        if fetch_error is None:
+                            logger.exception(f"Error in process_reddit_data_streaming: {e}")
+                            st.error(f"An error occurred during data processing: {e}")
+                if fetch_error is not None:
+                    st.error(f"Failed to fetch data from Reddit: {fetch_error}")
+                elif post_count:
+                    st.success(f"Fetched {post_count} threads.")
+                    if vectordb is not None:
+                        if rebuilt:
+                            # Drop only this collection's cached chain (the vector store arg isn't hashed)
+                            _build_qa_chain.clear(collection_name, None)
                         st.session_state.vectordb = vectordb
                         st.session_state.qa_chain = create_qa_chain(vectordb)
                         st.session_state.last_response = None # Reset chat on new data
@@ -273,7 +511,7 @@ if ask_button and question:
 # Display Result (Persisted)
 if st.session_state.last_response:
     st.markdown("### 🤖 Insight")
-    st.markdown(f"<div style='background-color: #1E1E1E; padding: 20px; border-radius: 10px; border-left: 5px solid #4285F4;'>{st.session_state.last_response['result']}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div class='insight-card'>{st.session_state.last_response['result']}</div>", unsafe_allow_html=True)
     
     st.markdown("<br>", unsafe_allow_html=True)
     with st.expander("📚 View Source Comments"):
@@ -1,8 +1,15 @@
+import asyncio
 import asyncpraw
-import json
+import atexit
+import hashlib
+import orjson
 import os
 from dotenv import load_dotenv
 import logging
+import queue
+import re
+import threading
+from logging.handlers import QueueHandler, QueueListener
 import time
 
 load_dotenv()
@@ -10,106 +17,252 @@ load_dotenv()
 # --- Configure Logging ---
 LOG_FILE = "reddit_data.log"
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG) 
+logger.setLevel(logging.INFO)
 
-file_handler = logging.FileHandler(LOG_FILE)
-file_handler.setLevel(logging.DEBUG) 
+# Streamlit re-imports this module on reruns; only attach the handlers once
+if not logger.handlers:
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
 
-logger.addHandler(file_handler)
+    # Log calls only enqueue the record; a background listener does the file I/O
+    # so the event loop never blocks on a write.
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, file_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
-# --- Helper Function ---
-async def _fetch_comments(submission):
-    """Helper function to fetch and process comments."""
+# Max number of comment trees fetched concurrently (keeps us within Reddit rate limits)
+MAX_CONCURRENT_FETCHES = 16
+# Max number of submissions buffered between the search listing and the fetchers
+SUBMISSION_QUEUE_SIZE = 32
+# Threads with at least this many comments never expand "load more comments" nodes
+MORE_COMMENTS_THRESHOLD = 500
+# Comments shorter than this (after stripping quotes) are dropped as noise ("+1", "same here")
+MIN_COMMENT_LENGTH = 20
+QUOTE_LINE_RE = re.compile(r"^>.*$", flags=re.M)
+
+USER_AGENT = "Android Scrapper 4.0 by Rugved"
+
+# --- Shared Event Loop & Reddit Client ---
+# asyncpraw's session is tied to the event loop it was created on. All fetches
+# run on one long-lived loop in a daemon thread (see run_coroutine), so the
+# client and its connection pool live across calls instead of per asyncio.run().
+_loop = None
+_loop_lock = threading.Lock()
+_reddit = None
+_reddit_loop = None
+
+def _get_event_loop():
+    """Returns the long-lived background event loop, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="reddit-event-loop", daemon=True).start()
+    return _loop
+
+def run_coroutine(coro):
+    """Runs a coroutine on the shared background loop and blocks until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+async def _get_reddit():
+    """Returns the shared asyncpraw client, creating it on first use."""
+    global _reddit, _reddit_loop
+    loop = asyncio.get_running_loop()
+    if _reddit is not None and _reddit_loop is loop:
+        return _reddit
+
+    # Called from a different loop (e.g. a plain asyncio.run()): replace the client
+    # and close the old one so its aiohttp session isn't leaked.
+    old_reddit, old_loop = _reddit, _reddit_loop
+    _reddit = asyncpraw.Reddit(
+        client_id=os.getenv("REDDIT_CLIENT_ID"),
+        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+        user_agent=USER_AGENT,
+    )
+    _reddit_loop = loop
+    if old_reddit is not None:
+        try:
+            if old_loop.is_running():
+                asyncio.run_coroutine_threadsafe(old_reddit.close(), old_loop)
+            else:
+                await old_reddit.close()
+        except Exception as e:
+            logger.error(f"Error closing previous Reddit client: {e}")
+    return _reddit
+
+@atexit.register
+def _close_reddit():
+    """Closes the shared client on interpreter exit."""
+    if _reddit is None or _reddit_loop.is_closed():
+        return
+    try:
+        if _reddit_loop.is_running():
+            asyncio.run_coroutine_threadsafe(_reddit.close(), _reddit_loop).result(timeout=5)
+        else:
+            _reddit_loop.run_until_complete(_reddit.close())
+    except Exception as e:
+        logger.error(f"Error closing Reddit client: {e}")
+
+# --- Helper Functions ---
+def _dedupe_comments(comments_data):
+    """Strips quoted lines, drops very short comments and removes duplicates."""
+    seen = set()
+    deduped = []
+    for comment in comments_data:
+        body = QUOTE_LINE_RE.sub("", comment).strip()
+        if len(body) < MIN_COMMENT_LENGTH:
+            continue
+        digest = hashlib.md5(body.lower().encode("utf-8")).digest()[:8]
+        if digest in seen:
+            continue
+        seen.add(digest)
+        deduped.append(body)
+    return deduped
+
+async def _fetch_comments(submission, max_more_comments=0):
+    """
+    Helper function to fetch and process comments.
+
+    Only up to `max_more_comments` "load more comments" nodes are expanded (0
+    drops them, None expands all), and only for threads below
+    MORE_COMMENTS_THRESHOLD comments.
+    """
     comments_data = []
-    if submission.num_comments > 0:
+    # Search listings and reddit.submission() return already-loaded submissions, so
+    # these attribute reads are local; calling submission.load() would add a request.
+    num_comments = submission.num_comments
+    if num_comments > 0:
         try:
             comments = await submission.comments()
             if comments:
-                await comments.replace_more(limit=None)
+                limit = max_more_comments if num_comments < MORE_COMMENTS_THRESHOLD else 0
+                await comments.replace_more(limit=limit)
                 for comment in comments.list():
                     if comment and comment.body not in ("[removed]", "[deleted]"):
-                        comments_data.append({"body": comment.body})
+                        comments_data.append(comment.body)
+                comments_data = _dedupe_comments(comments_data)
         except Exception as e:
-            logger.error(f"Error fetching comments for {submission.title}: {e}")
+            logger.error(f"Error fetching comments for {submission.id}: {e}")
     else:
-        comments_data.append({"body": "Comments are disabled!"})
+        comments_data.append("Comments are disabled!")
     return comments_data
 
-# --- Data Fetching Functions ---
-async def get_posts_by_flair(search_term, data_dir="data"):
-    """Fetches posts by flair, saves to JSON, and returns data."""
-    user_agent = "Android Scrapper 4.0 by Rugved"
-    reddit = asyncpraw.Reddit(
-        client_id=os.getenv("REDDIT_CLIENT_ID"),
-        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-        user_agent=user_agent,
-    )
+async def _build_post(submission, max_more_comments=0):
+    """Builds the post dict (title, text, comments) for a submission."""
+    logger.debug("Processing submission: %s", submission.title)
+    return {
+        'title': submission.title,
+        'text': submission.selftext,
+        'comments': await _fetch_comments(submission, max_more_comments)
+    }
+
+async def _stream_posts(submissions, max_more_comments=0):
+    """
+    Fetches posts through a bounded producer/consumer queue and yields each one
+    as soon as its comments are in, so only the queued submissions are held in
+    memory while fetching.
+    """
+    submission_queue = asyncio.Queue(maxsize=SUBMISSION_QUEUE_SIZE)
+    results = asyncio.Queue(maxsize=SUBMISSION_QUEUE_SIZE)
+
+    async def producer():
+        try:
+            async for submission in submissions:
+                await submission_queue.put(submission)
+        finally:
+            for _ in range(MAX_CONCURRENT_FETCHES):
+                await submission_queue.put(None)
+
+    async def consumer():
+        while (submission := await submission_queue.get()) is not None:
+            try:
+                await results.put(await _build_post(submission, max_more_comments))
+            except Exception as e:
+                logger.error(f"Error processing submission {submission.id}: {e}")
+        await results.put(None)
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(consumer()) for _ in range(MAX_CONCURRENT_FETCHES)]
+    try:
+        finished = 0
+        while finished < MAX_CONCURRENT_FETCHES:
+            post = await results.get()
+            if post is None:
+                finished += 1
+            else:
+                yield post
+        # Surfaces any error raised by the search listing
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
 
+# --- Data Fetching Functions ---
+async def get_posts_by_flair(search_term, data_dir="data", max_more_comments=0):
+    """Yields posts by flair, streaming them to an NDJSON file as they arrive."""
     os.makedirs(data_dir, exist_ok=True)
-    filename = f"{search_term.replace(' ', '_')}.json"
+    filename = f"{search_term.replace(' ', '_')}.ndjson"
     filepath = os.path.join(data_dir, filename)
 
     if os.path.exists(filepath):
+        # Stream the cache one line at a time so only one post is held in memory
+        yielded = False
         try:
-            with open(filepath, "r") as f:
-                logger.info(f"Loading data from {filepath}")
-                return json.load(f)
-        except (json.JSONDecodeError, OSError) as e:
+            logger.info(f"Loading data from {filepath}")
+            with open(filepath, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        post = orjson.loads(line)
+                        yield post
+                        yielded = True
+            return
+        except (orjson.JSONDecodeError, OSError) as e:
+            if yielded:
+                # Too late to fall back: drop the corrupt cache so the next load refetches
+                logger.error(f"Error reading {filepath} part-way, removing it: {e}")
+                os.remove(filepath)
+                raise
             logger.error(f"Error reading {filepath}, fetching from Reddit: {e}")
         except Exception as e:
             logger.exception(f"Unexpected error reading {filepath}: {e}")
-            return []
+            if yielded:
+                raise
+            return
 
     try:
+        reddit = await _get_reddit()
         subreddit = await reddit.subreddit("android_beta")
         logger.info(f"Fetching posts for flair: {search_term}")
         submissions = subreddit.search(f'flair_name:"{search_term}"')
-        all_posts_data = []
-
-        async for submission in submissions:
-            logger.debug(f"Processing submission: {submission.title}")
-            post_data = {
-                'title': submission.title,
-                'text': submission.selftext,
-                'comments': await _fetch_comments(submission)
-            }
-            all_posts_data.append(post_data)
 
-        with open(filepath, "w") as f:
-            json.dump(all_posts_data, f, indent=4)
-            logger.info(f"Data saved to {filepath}")
-
-        return all_posts_data
+        # Write to a temp file first so an interrupted fetch never looks like a valid cache
+        temp_path = f"{filepath}.part"
+        with open(temp_path, "wb") as f:
+            async for post in _stream_posts(submissions, max_more_comments):
+                f.write(orjson.dumps(post) + b"\n")
+                yield post
+        os.replace(temp_path, filepath)
+        logger.info(f"Data saved to {filepath}")
 
     except asyncpraw.exceptions.RedditAPIException as e:
         logger.error(f"Reddit API Error: {e}")
-        return []
+        raise
     except Exception as e:
         logger.exception(f"An unexpected error occurred: {e}")
-        return []
-    finally:
-        await reddit.close()
+        raise
 
 
-async def get_post_by_url(post_url):
+async def get_post_by_url(post_url, max_more_comments=0):
     """Fetches a single Reddit post and its comments given its URL."""
     try:
-        reddit = asyncpraw.Reddit(
-            client_id=os.getenv("REDDIT_CLIENT_ID"),
-            client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-            user_agent="Android Scrapper 4.0 by Rugved",
-        )
+        reddit = await _get_reddit()
         submission = await reddit.submission(url=post_url)
-        post_data = {
-            'title': submission.title,
-            'text': submission.selftext,
-            'comments': await _fetch_comments(submission)
-        }
-        await reddit.close()
-        return [post_data]
+        return [await _build_post(submission, max_more_comments)]
 
     except asyncpraw.exceptions.RedditAPIException as e:
         logger.error(f"Reddit API Error fetching post by URL: {e}")
@@ -118,57 +271,53 @@ async def get_post_by_url(post_url):
         logger.exception(f"Error fetching post by URL: {e}")
         return []
 
-async def get_posts_by_keywords_and_time(subreddit_name, keywords, time_filter):
-    """Fetches posts from a subreddit matching keywords and a time filter."""
+async def get_posts_by_keywords_and_time(subreddit_name, keywords, time_filter, max_more_comments=0):
+    """Yields posts from a subreddit matching keywords and a time filter."""
     try:
-        reddit = asyncpraw.Reddit(
-            client_id=os.getenv("REDDIT_CLIENT_ID"),
-            client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-            user_agent="Android Scrapper 4.0 by Rugved",
-        )
+        reddit = await _get_reddit()
         subreddit = await reddit.subreddit(subreddit_name)
         query = f"{keywords}"
         logger.info(f"Fetching posts from r/{subreddit_name} with keywords: '{keywords}', time_filter: {time_filter}")
         submissions = subreddit.search(query, time_filter=time_filter)
-        all_posts_data = []
-
-        async for submission in submissions:
-            post_data = {
-                'title': submission.title,
-                'text': submission.selftext,
-                'comments': await _fetch_comments(submission)
-            }
-            all_posts_data.append(post_data)
-        await reddit.close()
-        return all_posts_data
+        async for post in _stream_posts(submissions, max_more_comments):
+            yield post
 
     except asyncpraw.exceptions.RedditAPIException as e:
         logger.error(f"Reddit API Error: {e}")
-        return []
+        raise
     except Exception as e:
         logger.exception(f"An unexpected error occurred: {e}")
-        return []
+        raise
 
 # --- Main Data Fetching Function which works as a Router ---
-async def get_reddit_data(data_type, identifier, time_filter=None, data_dir="data"):
+async def get_reddit_data(data_type, identifier, time_filter=None, data_dir="data", max_more_comments=0):
     """
-    Fetches Reddit data based on the specified data type and identifier.
+    Fetches Reddit data based on the specified data type and identifier,
+    yielding each post as soon as it has been fetched.
 
     Args:
         data_type (str): 'flair', 'url', or 'keywords'.
         identifier (str): The flair, URL, or keywords.
         time_filter (str, optional): Time filter for keywords search.
         data_dir (str): The directory to save data (for flair).
+        max_more_comments (int, optional): "Load more comments" nodes to expand
+            per thread; 0 skips them, None expands all of them.
+
+    Yields:
+        dict: A post with its 'title', 'text' and 'comments'.
 
-    Returns:
-        list: The fetched Reddit data.
+    Raises:
+        Exception: If a flair or keyword fetch fails part-way, after some posts
+            may already have been yielded.
     """
     if data_type == "flair":
-        return await get_posts_by_flair(identifier, data_dir)
+        async for post in get_posts_by_flair(identifier, data_dir, max_more_comments):
+            yield post
     elif data_type == "url":
-        return await get_post_by_url(identifier)
+        for post in await get_post_by_url(identifier, max_more_comments):
+            yield post
     elif data_type == "keywords":
-        return await get_posts_by_keywords_and_time("android_beta", identifier, time_filter)
+        async for post in get_posts_by_keywords_and_time("android_beta", identifier, time_filter, max_more_comments):
+            yield post
     else:
         logger.error(f"Invalid data_type: {data_type}")
-        return []
\ No newline at end of file